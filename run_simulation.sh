@@ -46,7 +46,6 @@ read -p "Enter the number of the task you want to run: " task
 case $task in
     1)
         echo "Running Stage 1..."
-        filepath="Galveston_data/location_data.csv"
 
         # Run GetCapacityList.py to generate capacity list
         echo "Generating Capacity List..."
@@ -1,20 +1,31 @@
 # import libraries
 import pandas as pd
-import numpy as np
 import folium
 import requests
-import pandas as pd
-import numpy as np
+import concurrent.futures
+import itertools
 import polyline
 import pickle
 import configparser
 import sys
 import os
 from folium import IFrame
+from urllib3.util.retry import Retry
 
 # import the BeautifyIcon class
 import folium.plugins
 
+# Directions API endpoint, the stops are appended to it
+DIRECTIONS_URL = "https://api.mapbox.com/directions/v5/mapbox/driving/"
+
+# Number of directions requests kept in flight, each with its own pooled connection
+MAX_WORKERS = 4
+
+# popup shown for every stop on the map
+POPUP_TEMPLATE = ("<p>Name: {name}</p><p>Category: {category}</p>"
+                  "<p>Pickup Totes: {pickup_capacity}</p>"
+                  "<p>Route Number: {truck_route}</p>")
+
 
 def read_config(root_dir):
     """
@@ -55,26 +66,24 @@ def parse_route_data(route_data):
     :return: route_dict: dictionary of route name as key and route list as value
     '''
 
-    # convert route_list to a dictionary
-    # The code below just create a dictionary with route name as key and route list as value
-    # convert route_data to a dictionary
+    # convert route_data to a dictionary with route name as key and route list as value
+    # The route list is split into lists of at most 25 stops in the same pass.
+    # Consecutive lists share their boundary stop so the leg between them is routed too.
     route_dict = {}
-    for i in range(len(route_data)):
-        route_dict['Route {}'.format(i+1)] = route_data[i]
-
-
-    # For each key in route_dict, if the list size is greater than 25, split the list into lists of 25
-    for key in route_dict.keys():
-        if len(route_dict[key]) > 25:
-            route_dict[key] = [route_dict[key][i:i+25] for i in range(0, len(route_dict[key]), 25)]
-        else:
-            route_dict[key] = [route_dict[key]]
+    for i, route in enumerate(route_data):
+        # an unused vehicle goes straight from the depot back to the depot,
+        # there is nothing to request directions for or to draw
+        if len(route) <= 2:
+            continue
+        route_dict['Route {}'.format(i+1)] = [route[j:j+25] for j in range(0, max(len(route) - 1, 1), 24)]
 
     return route_dict
 
 def parse_supplemental_data(datafile):
 
-    df = pd.read_csv(datafile)
+    # only parse the columns used on the map
+    df = pd.read_csv(datafile, usecols=['Name', 'Latitude', 'Longitude',
+                                        'Daily_Pickup_Totes', 'location_type'])
 
     # create a dictionary from the df dataframe where the key is the index and value is the name
     name_dict = dict(zip(df.index, df['Name']))
@@ -91,6 +100,29 @@ def parse_supplemental_data(datafile):
 
     return name_dict, category_dict, pickup_capacity_dict, lat_long_dict
 
+def get_directions(stop_indices, lat_long_dict, session):
+    '''
+    :param stop_indices: indices of the stops to route through, in order
+    :param lat_long_dict: dictionary of index as key and latitude and longitude as value
+    :param session: requests.Session shared by all directions calls, carrying the request parameters
+    :return: duration of the route and its decoded road geometry
+    '''
+
+    # the directions api expects the stops as "lon,lat" pairs
+    end_url = ";".join([f"{lat_long_dict[s][1]},{lat_long_dict[s][0]}" for s in stop_indices])
+    url = DIRECTIONS_URL + end_url
+    response = session.get(url)
+
+    # check if the response is valid, a route can be missing even when the request succeeds
+    if response.status_code != 200:
+        raise Exception(f"Error fetching directions from Mapbox API: {response.text}")
+    res = response.json()
+    if res['code'] != 'Ok':
+        raise Exception(f"No directions found by Mapbox API: {res.get('message', res['code'])}")
+
+    polyline_str = res['routes'][0]['geometry']
+    return res['routes'][0]['duration'], polyline.decode(polyline_str)
+
 def create_map(route_dict, name_dict, category_dict, pickup_capacity_dict, lat_long_dict, mapbox_token, central_coordinates, html):
     '''
     :param route_dict: dictionary of route name as key and route list as value
@@ -103,8 +135,35 @@ def create_map(route_dict, name_dict, category_dict, pickup_capacity_dict, lat_l
     :return: folium map
     '''
 
-    starting_url = "https://api.mapbox.com/directions/v5/mapbox/driving/"
-    params = {'access_token': mapbox_token, 'overview': 'full'}
+    # each stop is a single {stop_index: accumulated_load} entry
+    stop_dict = {truck_route: [[next(iter(i)) for i in route] for route in routes]
+                 for truck_route, routes in route_dict.items()}
+
+    # The directions requests are independent, so they are all submitted up front
+    # and run concurrently. A single session reuses the TCP/TLS connections
+    # across all of them and retries transient server errors.
+    # Rate limited requests are retried too, after the Retry-After delay when the api sends one.
+    with requests.Session() as session, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=MAX_WORKERS,
+            max_retries=Retry(total=3, backoff_factor=0.5, backoff_jitter=0.5,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        session.params = {'access_token': mapbox_token, 'overview': 'full'}
+        futures_dict = {truck_route: [executor.submit(get_directions, stop_indices,
+                                                      lat_long_dict, session)
+                                      for stop_indices in stop_lists]
+                        for truck_route, stop_lists in stop_dict.items()}
+        try:
+            directions_dict = {truck_route: [future.result() for future in futures]
+                               for truck_route, futures in futures_dict.items()}
+        except BaseException:
+            # The map needs every route, so the queued requests are cancelled
+            # instead of spending API quota once one has failed
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     # Create a folium map centered at the mean of the locations
     m = folium.Map(location=central_coordinates, zoom_start=12)
@@ -114,32 +173,23 @@ def create_map(route_dict, name_dict, category_dict, pickup_capacity_dict, lat_l
     color_lst = ['red', 'blue', 'green', 'purple', 'orange', 'darkred']
     for truck_route in route_dict.keys():
         route_color = color_lst.pop()
-
-        for route in route_dict[truck_route]:
-            coordinate_lst = []
-            for i in route:
-                stop_index = list(i.keys())[0]
-                accumulated_load = list(i.values())[0]
-                coordinates = (lat_long_dict[stop_index][1], lat_long_dict[stop_index][0])
-                coordinate_lst.append(coordinates)
-            end_url = ";".join([f"{lon},{lat}" for lon, lat in coordinate_lst])
-            url = starting_url + end_url
-            response = requests.get(url, params=params)
-            res = response.json()
-            total_duration += res['routes'][0]['duration']
-
-            polyline_str = res['routes'][0]['geometry']
-            coords = polyline.decode(polyline_str)
-
-            for i in route:
-                stop_index = list(i.keys())[0]
-                coordinates = [lat_long_dict[stop_index][0], lat_long_dict[stop_index][1]]
-                name = name_dict[stop_index]
-                pickup_capacity = pickup_capacity_dict[stop_index]
+        # the road geometry of every chunk, the chunks share their boundary stops
+        # so they are joined into a single continuous line
+        route_coords = []
+
+        for k, (stop_indices, (duration, coords)) in enumerate(zip(stop_dict[truck_route], directions_dict[truck_route])):
+            total_duration += duration
+            route_coords.append(coords)
+
+            # reuse the stop indices parsed for the directions request,
+            # the first stop of a later chunk already has a marker from the previous one
+            first = 0 if k == 0 else 1
+            for stop_index in stop_indices[first:]:
+                coordinates = lat_long_dict[stop_index]
                 category = category_dict[stop_index]
-                html_content = f"<p>Name: {name}</p><p>Category: {category}</p>\
-                <p>Pickup Totes: {pickup_capacity}</p> \
-                <p>Route Number: {truck_route}</p>"
+                html_content = POPUP_TEMPLATE.format(name=name_dict[stop_index], category=category,
+                                                     pickup_capacity=pickup_capacity_dict[stop_index],
+                                                     truck_route=truck_route)
                 iframe = IFrame(html_content, width=200, height=100)
                 popup = folium.Popup(iframe, max_width=2650)
 
@@ -166,10 +216,10 @@ def create_map(route_dict, name_dict, category_dict, pickup_capacity_dict, lat_l
                     folium.Marker(location=coordinates, 
                         popup=popup, icon=icon_dot).add_to(m)
 
+        route = folium.PolyLine(locations=list(itertools.chain.from_iterable(route_coords)),
+                                color=route_color, weight=1)
+        route.add_to(m)
 
-            route = folium.PolyLine(locations=coords, color=route_color, weight=1)
-            route.add_to(m)
-    
     html_path = html
     with open(html_path, 'r') as file:
         legend_html = file.read()
@@ -11,6 +11,7 @@ from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 import pickle
 import sys
+import time
 import datetime
 import numpy as np
 import os
@@ -34,8 +35,29 @@ def read_config(root_dir):
     multiplier = ast.literal_eval(config['cvrp']['MULTIPLIER'])
     vehicle_capacities = ast.literal_eval(config['cvrp']['VEHICLE_CAPACITIES'])
     solver_time_limit = ast.literal_eval(config['cvrp']['SOLVER_TIME_LIMIT'])
+    first_solution_strategy = config['cvrp'].get('FIRST_SOLUTION_STRATEGY', 'PATH_CHEAPEST_ARC')
+    strategies = routing_enums_pb2.FirstSolutionStrategy.Value
+    try:
+        strategies.Value(first_solution_strategy)
+    except ValueError:
+        raise ValueError(f"Invalid FIRST_SOLUTION_STRATEGY '{first_solution_strategy}' in config.ini, "
+                         f"expected one of: {', '.join(strategies.keys())}")
+
+    return total_vehicles, multiplier, vehicle_capacities, solver_time_limit, first_solution_strategy
 
-    return total_vehicles, multiplier, vehicle_capacities, solver_time_limit
+def load_initial_routes(route_file):
+    """
+    Loads a previously generated route list to warm start the solver.
+
+    :param route_file: Path to a route list saved by this script.
+    :return: List of routes, each a list of node indices without the depot.
+    """
+    with open(route_file, 'rb') as f:
+        route_list = pickle.load(f)
+
+    # Each stop is saved as {node_index: accumulated_load} and every route
+    # starts and ends at the depot, which OR-Tools does not expect here.
+    return [[node for stop in route for node in stop][1:-1] for route in route_list]
 
 def create_data_model(matrix_file, capacity_file, total_vehicles, vehicle_capacities, multiplier=1):
     """Stores the data for the problem."""
@@ -43,8 +65,16 @@ def create_data_model(matrix_file, capacity_file, total_vehicles, vehicle_capaci
     data = {}
     # Note: The matrix is divided by the MULTIPLIER as it 
     # reduces calculation time with rounded coordinates
-    data['distance_matrix'] = (np.load(matrix_file)/multiplier).astype(int)
-    data['demands'] = np.load(capacity_file, allow_pickle=True)
+    # The matrix is stored as int32, which comfortably fits road distances
+    # and halves its memory footprint compared to the default int64.
+    distance_matrix = np.load(matrix_file)/multiplier
+    # NaN would pass the check below and be cast to a large negative distance
+    if not np.isfinite(distance_matrix).all():
+        raise ValueError("Distance matrix contains unroutable (null) pairs, regenerate it or remove the affected locations.")
+    if distance_matrix.max() > np.iinfo(np.int32).max:
+        raise ValueError("Distances are too large to be stored as 32-bit integers, increase the MULTIPLIER.")
+    data['distance_matrix'] = distance_matrix.astype(np.int32)
+    data['demands'] = np.asarray(np.load(capacity_file, allow_pickle=True), dtype=np.int64)
     data['num_vehicles'] = int(total_vehicles)
     data["vehicle_capacities"] = vehicle_capacities
     data['depot'] = 0
@@ -52,7 +82,7 @@ def create_data_model(matrix_file, capacity_file, total_vehicles, vehicle_capaci
 
 # Functions below are derived from Google OR-Tools CVRP example
 
-def capacitated_routing(data, solver_time_limit=60):
+def capacitated_routing(data, solver_time_limit=60, first_solution_strategy='PATH_CHEAPEST_ARC'):
     
     # Create the routing index manager.
     manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
@@ -61,27 +91,17 @@ def capacitated_routing(data, solver_time_limit=60):
     # Create Routing Model.
     routing = pywrapcp.RoutingModel(manager)
 
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    # Register the distance matrix as a transit evaluator.
+    # The matrix is stored in the solver itself, so arc costs are looked up
+    # in C++ instead of calling back into Python for every arc.
+    transit_callback_index = routing.RegisterTransitMatrix(data['distance_matrix'].tolist())
 
     # Define cost of each arc.
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
     # Add Capacity constraint.
-    def demand_callback(from_index):
-        """Returns the demand of the node."""
-        # Convert from routing variable Index to demands NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        return data["demands"][from_node]
-
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+    # Like the distances, the demands are registered as a vector looked up in C++.
+    demand_callback_index = routing.RegisterUnaryTransitVector(data["demands"].tolist())
     routing.AddDimensionWithVehicleCapacity(
         demand_callback_index,
         0,  # null capacity slack
@@ -91,16 +111,36 @@ def capacitated_routing(data, solver_time_limit=60):
     )
 
     # Setting first solution heuristic.
+    # Guided local search depends heavily on its starting point, so the
+    # heuristic is configurable to try other strategies on a dataset.
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
     search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+        getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy))
 
     search_parameters.local_search_metaheuristic = (routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
     search_parameters.log_search = True
     search_parameters.time_limit.FromSeconds(solver_time_limit)
 
-    # Solve the problem
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem, starting from the initial routes when they are feasible
+    initial_solution = None
+    if data.get('initial_routes'):
+        # Reading the routes closes the model, so it is closed with the search
+        # parameters first, otherwise the defaults would replace them.
+        routing.CloseModelWithParameters(search_parameters)
+        # NodeToIndex does not check its input, so routes from another dataset
+        # are caught here instead of being read as wrong indices.
+        num_nodes = len(data['distance_matrix'])
+        if all(0 <= node < num_nodes for route in data['initial_routes'] for node in route):
+            initial_routes = [[manager.NodeToIndex(node) for node in route]
+                              for route in data['initial_routes']]
+            initial_solution = routing.ReadAssignmentFromRoutes(initial_routes, True)
+        if initial_solution is None:
+            print('Initial routes are not feasible for this model, solving from scratch.')
+
+    if initial_solution:
+        solution = routing.SolveFromAssignmentWithParameters(initial_solution, search_parameters)
+    else:
+        solution = routing.SolveWithParameters(search_parameters)
 
     return solution, manager, routing
 
@@ -109,7 +149,8 @@ def get_file_paths():
     """
     Retrieves file paths from command line arguments.
 
-    :return: A tuple containing the matrix file path and the capacity file path.
+    :return: A tuple containing the matrix file path, the capacity file path
+             and the optional route list file path used as a warm start.
     :raises IndexError: If the required arguments are not provided.
     """
     if len(sys.argv) < 3:
@@ -117,8 +158,9 @@ def get_file_paths():
 
     matrix_file = sys.argv[1]
     capacity_file = sys.argv[2]
+    initial_route_file = sys.argv[3] if len(sys.argv) > 3 else None
 
-    return matrix_file, capacity_file
+    return matrix_file, capacity_file, initial_route_file
 
 
 def main():
@@ -130,33 +172,37 @@ def main():
     data_dir = os.path.join(root_dir, 'data')
 
     # Get file paths
-    matrix_file, capacity_file = get_file_paths()
+    matrix_file, capacity_file, initial_route_file = get_file_paths()
     matrix_file = os.path.join(data_dir, matrix_file)
     capacity_file = os.path.join(data_dir, capacity_file)
 
     # Get routing configuration
     try:
-        total_vehicles, multiplier, vehicle_capacities, solver_time_limit = read_config(root_dir)
+        total_vehicles, multiplier, vehicle_capacities, solver_time_limit, \
+            first_solution_strategy = read_config(root_dir)
     except FileNotFoundError:
         raise FileNotFoundError("Config file not found.")
 
     # Instantiate the data problem.
     data = create_data_model(matrix_file, capacity_file, total_vehicles, vehicle_capacities, multiplier)
-    data['distance_matrix'] = data['distance_matrix'].tolist()
+    if initial_route_file:
+        data['initial_routes'] = load_initial_routes(os.path.join(data_dir, initial_route_file))
 
-    # Solve the problem.
-    solution, manager, routing = capacitated_routing(data, solver_time_limit)
+    # Get timestamp for output file once, when the solve starts.
+    # Seconds are included so that consecutive runs do not overwrite each other.
+    timestamp_str = datetime.datetime.now().strftime('%Y-%m-%d_%H:%M:%S')
 
-    # Get timestamp for output file
-    current_datetime = datetime.datetime.now()
-    timestamp_str = current_datetime.strftime('%Y-%m-%d_%H:%M')
+    # Solve the problem, timing it with a monotonic clock.
+    start_ns = time.monotonic_ns()
+    solution, manager, routing = capacitated_routing(data, solver_time_limit, first_solution_strategy)
+    print(f"Solver runtime: {(time.monotonic_ns() - start_ns) / 1e9:.2f}s")
 
     # Print solution on console.
     if solution:
         utils.print_solution(data, manager, routing, solution)
         route_list, distance_list = utils.save_to_table(data, manager, routing, solution)
-        route_output = f"{data_dir}/generated_route_list/route_list_{timestamp_str}.pkl"
-        distance_output = f"{data_dir}/generated_distance_list/distance_list_{timestamp_str}.pkl"
+        route_output = os.path.join(data_dir, 'generated_route_list', f"route_list_{timestamp_str}.pkl")
+        distance_output = os.path.join(data_dir, 'generated_distance_list', f"distance_list_{timestamp_str}.pkl")
         with open(route_output, 'wb') as f:
             pickle.dump(route_list, f)
         with open(distance_output, 'wb') as f:
@@ -4,43 +4,118 @@ import configparser
 import numpy as np
 import tqdm
 import time
+import random
 import datetime
+import functools
+import concurrent.futures
+import threading
 import sys
 import os
+from urllib3.util.retry import Retry
 
-def get_matrix_data(coordinates, access_token):
+# Matrix API endpoint (assuming driving mode here, but can be changed to walking, cycling, etc.)
+MATRIX_URL = "https://api.mapbox.com/directions-matrix/v1/mapbox/driving/"
+
+# Number of times a rate limited API call is attempted
+MAX_RETRIES = 5
+# Without a Retry-After header, rate limited calls back off exponentially from
+# RATE_LIMIT_BACKOFF seconds up to RATE_LIMIT_BACKOFF_MAX, the length of the rate limit window
+RATE_LIMIT_BACKOFF = 5
+RATE_LIMIT_BACKOFF_MAX = 60
+# Number of API calls kept in flight, each with its own pooled connection
+MAX_WORKERS = 4
+
+# A Matrix API call takes at most 25 coordinates. Splitting them into
+# blocks of sources and destinations covers far more of the matrix per call
+# than a single source with 24 destinations (156 vs 24 entries).
+SOURCES_PER_CALL = 12
+DESTINATIONS_PER_CALL = 13
+
+@functools.lru_cache(maxsize=None)
+def get_indices(start, stop):
+    """
+    Build a sources or destinations parameter for a Matrix API call.
+    Only a couple of call sizes occur, so the string is built once per size.
+
+    :param start: Index of the first coordinate
+    :param stop: Index after the last coordinate
+    :return: Semicolon separated indices of the coordinates from start to stop
+    """
+    return ";".join([str(i) for i in range(start, stop)])
+
+class RateLimiter:
+    """
+    Spaces out API calls made from several threads.
+
+    :param min_interval: Minimum number of seconds between the start of two calls
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        """Blocks until the next call is allowed to start."""
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def pause(self, delay):
+        """Holds back every following call for at least delay seconds."""
+        with self.lock:
+            self.next_call = max(self.next_call, time.monotonic() + delay)
+
+def get_matrix_data(coordinates, num_sources, session, rate_limiter):
     """
     Fetch travel time matrix using Mapbox Matrix API. 
-    Sets the first coordinate as the source and the rest as destinations.
+    Sets the first num_sources coordinates as the sources and the rest as destinations.
 
     :param coordinates: List of coordinates [longitude, latitude]
-    :param access_token: Your Mapbox Access Token
-    :return: JSON response from Mapbox API
+    :param num_sources: Number of coordinates at the start of the list that are sources
+    :param session: requests.Session reused across calls to keep the connection alive,
+                    carrying the access token and annotations shared by every call
+    :param rate_limiter: RateLimiter shared by every thread calling the API
+    :return: Distances from every source to every destination, one row per source
     """
     # Convert list of coordinates to string format
     coordinates_str = ";".join([f"{lon},{lat}" for lon, lat in coordinates])
 
-    # Endpoint URL (assuming driving mode here, but can be changed to walking, cycling, etc.)
-    url = f"https://api.mapbox.com/directions-matrix/v1/mapbox/driving/{coordinates_str}"
+    # Endpoint URL
+    url = MATRIX_URL + coordinates_str
 
-    # Parameters
+    # Parameters, the ones shared by every call are set on the session
     params = {
-        "access_token": access_token,
-        "annotations": "distance",
-        "sources": "0",
-        # Destinations are all coordinates after the first one
-        "destinations": ";".join([str(i) for i in range(1, len(coordinates))]),
+        "sources": get_indices(0, num_sources),
+        # Destinations are all coordinates after the sources
+        "destinations": get_indices(num_sources, len(coordinates)),
     }
 
-    # Make the API call
-    response = requests.get(url, params=params)
+    # Make the API call.
+    # When rate limited, every thread is held back as long as the API asks
+    # (or with a capped exponential backoff) before this call is retried.
+    # The jitter keeps the worker threads from all retrying at the same moment.
+    for attempt in range(MAX_RETRIES):
+        rate_limiter.wait()
+        response = session.get(url, params=params)
+        if response.status_code != 429 or attempt == MAX_RETRIES - 1:
+            break
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            delay = float(retry_after)
+        else:
+            delay = min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF * 2 ** attempt)
+        rate_limiter.pause(delay + random.uniform(0, 1))
 
     #check if the response is valid
     if response.status_code != 200:
         raise Exception(f"Error fetching distances from Mapbox API: {response.text}")
 
-    # Return the JSON response
-    return response.json()
+    # Only the distances are used, the rest of the response is dropped right away
+    return response.json()['distances']
 
 def read_df(data_dir):
     """
@@ -60,9 +135,10 @@ def read_df(data_dir):
     
     csv_path = os.path.join(data_dir, file_name)
 
-    # Load the CSV file
+    # Load the CSV file, only the coordinate columns are used.
+    # A callable keeps missing columns from failing the read, so the check below reports them.
     try:
-        df = pd.read_csv(csv_path)
+        df = pd.read_csv(csv_path, usecols=lambda column: column in ('Longitude', 'Latitude'))
     except FileNotFoundError:
         raise FileNotFoundError(f"The file '{file_name}' was not found.")
 
@@ -103,25 +179,63 @@ def generated_matrix(df, mapbox_token):
     :return: Distance matrix
     """
 
-    # Initialize the matrix
-    full_matrix = np.zeros(len(df))
-
-    # Get the matrix data. 
-    # Goes through every source once and then every destination for every source.
-    col_idx = df.columns.get_loc('Coordinates')
-    for i in tqdm.tqdm(range(len(df))):
-        horizontal = [[]]
-        # Goes through 24 destinations for every source as the mapbox api 
-        # is limited to 25 coordinates per call
-        for j in range(0, len(df), 24):
-            coordinate_list = [df.iloc[i, col_idx]] + df.iloc[j:j+24, col_idx].tolist()
-            result = get_matrix_data(coordinate_list, mapbox_token)['distances']
-            horizontal = np.hstack((horizontal, result))
-            time.sleep(1)
-        full_matrix = np.vstack((full_matrix, horizontal))
-
-    # remove the first row which is all zeros
-    full_matrix = full_matrix[1:, :]
+    # Locations sharing the same coordinates have the same distances,
+    # so the API is only queried for the unique coordinates
+    unique_coordinates, inverse = np.unique(np.array(df['Coordinates'].tolist()), axis=0, return_inverse=True)
+    coordinates = unique_coordinates.tolist()
+    n = len(coordinates)
+
+    # Preallocate the matrix and fill it in place, one block per API call
+    unique_matrix = np.zeros((n, n))
+
+    # Goes through the matrix in blocks of sources and destinations as the
+    # mapbox api is limited to 25 coordinates per call.
+    # Every (source block, destination block) pair is an independent API call.
+    blocks = [(i, j) for i in range(0, n, SOURCES_PER_CALL) for j in range(0, n, DESTINATIONS_PER_CALL)]
+
+    # The mapbox matrix api allows 60 requests per minute
+    rate_limiter = RateLimiter(1)
+
+    # A single session reuses the TCP/TLS connections across all API calls,
+    # transient server errors are retried with backoff
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=MAX_WORKERS,
+            max_retries=Retry(total=3, backoff_factor=0.5, backoff_jitter=0.5,
+                              status_forcelist=[500, 502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        session.params = {"access_token": mapbox_token, "annotations": "distance"}
+
+        def fetch_block(i, j):
+            sources = coordinates[i:i+SOURCES_PER_CALL]
+            coordinate_list = sources + coordinates[j:j+DESTINATIONS_PER_CALL]
+            return get_matrix_data(coordinate_list, len(sources), session, rate_limiter)
+
+        # The calls are network bound, so a few threads keep requests in flight
+        # while the rate limiter spaces out their start times
+        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(fetch_block, i, j): (i, j) for i, j in blocks}
+            try:
+                for future in tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
+                    i, j = futures[future]
+                    unique_matrix[i:i+SOURCES_PER_CALL, j:j+DESTINATIONS_PER_CALL] = future.result()
+            except BaseException:
+                # Once a block has failed the matrix is lost anyway,
+                # so the queued blocks are cancelled instead of spending API quota
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    # Mapbox returns null for pairs it cannot route between, which numpy stores as NaN.
+    # The solver cannot use such a matrix, so it is not saved.
+    unroutable = np.argwhere(np.isnan(unique_matrix))
+    if len(unroutable):
+        pairs = ", ".join([f"{coordinates[i]} -> {coordinates[j]}" for i, j in unroutable[:10]])
+        raise ValueError(f"Mapbox API found no route for {len(unroutable)} pairs of coordinates "
+                         f"[longitude, latitude], e.g. {pairs}")
+
+    # Expand back to one row and column per location
+    full_matrix = unique_matrix[np.ix_(inverse, inverse)]
 
     return full_matrix
 
@@ -140,10 +254,10 @@ def main():
 
     # Get the current date and time for the file name
     current_datetime = datetime.datetime.now()
-    timestamp_str = current_datetime.strftime('%Y-%m-%d_%H:%M')
+    timestamp_str = current_datetime.strftime('%Y-%m-%d_%H:%M:%S')
        
     # Save the matrix to a file
-    filename = f"{data_dir}/generated_distance_matrices/distance_matrix_{timestamp_str}.npy"
+    filename = os.path.join(data_dir, 'generated_distance_matrices', f"distance_matrix_{timestamp_str}.npy")
     np.save(filename, distance_matrix)
     print('----Distance Matrix has been generated!----')
 
@@ -21,9 +21,9 @@ def get_data(data_dir):
     
     csv_path = os.path.join(data_dir, file_name)
 
-    # Load the CSV file
+    # Load the CSV file, parsing only the column needed for the capacity list
     try:
-        df = pd.read_csv(csv_path)
+        df = pd.read_csv(csv_path, usecols=['Daily_Pickup_Totes'])
     except FileNotFoundError:
         raise FileNotFoundError(f"The file '{file_name}' was not found.")
 
@@ -38,12 +38,12 @@ def save_capacity_list(df, data_dir):
     """
     # Get timestamp string
     current_datetime = datetime.datetime.now()
-    timestamp_str = current_datetime.strftime('%Y-%m-%d_%H:%M')
+    timestamp_str = current_datetime.strftime('%Y-%m-%d_%H:%M:%S')
 
     # save list as pkl file
-    capacity_file = f"{data_dir}/capacity_lists/capacity_list_{timestamp_str}.pkl"
+    capacity_file = os.path.join(data_dir, 'capacity_lists', f"capacity_list_{timestamp_str}.pkl")
     with open(capacity_file, 'wb') as f:
-        pickle.dump(list(map(int, df['Daily_Pickup_Totes'].tolist())), f)
+        pickle.dump(df['Daily_Pickup_Totes'].astype(int).tolist(), f)
 
 def main():
 
@@ -1,33 +1,36 @@
+import numpy as np
+
+
+def get_route_nodes(manager, routing, solution, vehicle_id):
+    """Returns the nodes visited by a vehicle, starting and ending at the depot."""
+    index = routing.Start(vehicle_id)
+    nodes = [manager.IndexToNode(index)]
+    while not routing.IsEnd(index):
+        index = solution.Value(routing.NextVar(index))
+        nodes.append(manager.IndexToNode(index))
+    return np.array(nodes)
+
+
+def get_route_metrics(data, nodes):
+    """Returns the accumulated load after each stop and the distance of a route."""
+    # The final depot is not a stop, so it adds no load
+    loads = np.cumsum(np.asarray(data["demands"])[nodes[:-1]])
+    # The arc cost of every vehicle is the distance matrix entry
+    route_distance = int(data["distance_matrix"][nodes[:-1], nodes[1:]].sum())
+    return loads, route_distance
+
+
 def save_to_table(data, manager, routing, solution):
-    """Prints solution on console."""
+    """Returns the route and distance of each vehicle in the solution."""
     print(f"Objective: {solution.ObjectiveValue()}")
     routes = []
     distances = []
-    total_distance = 0
-    total_load = 0
     for vehicle_id in range(data["num_vehicles"]):
-        route = []
-        index = routing.Start(vehicle_id)
-        plan_output = f"Route for vehicle {vehicle_id}:\n"
-        route_distance = 0
-        route_load = 0
-        while not routing.IsEnd(index):
-            node_index = manager.IndexToNode(index)
-            route_load += data["demands"][node_index]
-            plan_output += f" {node_index} Load({route_load}) -> "
-            route.append({node_index:route_load})
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id
-            )
-        plan_output += f" {manager.IndexToNode(index)} Load({route_load})\n"
-        route.append({manager.IndexToNode(index):route_load})
-        plan_output += f"Distance of the route: {route_distance}m\n"
-        plan_output += f"Load of the route: {route_load}\n"
-        #print(plan_output)
-        total_distance += route_distance
-        total_load += route_load
+        nodes = get_route_nodes(manager, routing, solution, vehicle_id)
+        loads, route_distance = get_route_metrics(data, nodes)
+        # The final depot keeps the load of the route
+        loads = np.append(loads, loads[-1])
+        route = [{node: load} for node, load in zip(nodes.tolist(), loads.tolist())]
         routes.append(route)
         distances.append(route_distance)
     return routes, distances
@@ -40,28 +43,19 @@ def print_solution(data, manager, routing, solution):
     total_distance = 0
     total_load = 0
     for vehicle_id in range(data["num_vehicles"]):
-        index = routing.Start(vehicle_id)
-        plan_output = f"Route for vehicle {vehicle_id}:\n"
-        route_distance = 0
-        route_load = 0
-        while not routing.IsEnd(index):
-            node_index = manager.IndexToNode(index)
-            route_load += data["demands"][node_index]
-            plan_output += f" {node_index} Load({route_load}) -> "
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id
-            )
-        plan_output += f" {manager.IndexToNode(index)} Load({route_load})\n"
-        plan_output += f"Distance of the route: {route_distance}m\n"
-        plan_output += f"Load of the route: {route_load}\n"
+        nodes = get_route_nodes(manager, routing, solution, vehicle_id)
+        loads, route_distance = get_route_metrics(data, nodes)
+        route_load = int(loads[-1])
+        stops = "".join(f" {node} Load({load}) -> "
+                        for node, load in zip(nodes[:-1].tolist(), loads.tolist()))
+        plan_output = (
+            f"Route for vehicle {vehicle_id}:\n"
+            f"{stops} {nodes[-1]} Load({route_load})\n"
+            f"Distance of the route: {route_distance}m\n"
+            f"Load of the route: {route_load}\n"
+        )
         print(plan_output)
         total_distance += route_distance
         total_load += route_load
     print(f"Total distance of all routes: {total_distance}m")
     print(f"Total load of all routes: {total_load}")
-
-
-def print_this():
-    print("hello bro")
\ No newline at end of file